@@ -1,35 +1,170 @@
 """
 Encoders
 """
-from functools import wraps
-from typing import Any, Callable, Dict, List, Optional, Set, Union
+from contextvars import ContextVar
+from functools import cached_property, wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Type, Union
 from datetime import datetime, date, timezone
 import dataclasses
 from enum import Enum
 from pathlib import PurePath
 from types import GeneratorType
-from pydantic import BaseModel, create_model
+import weakref
+from pydantic import BaseModel, TypeAdapter
 
 
 def datetime_encoder(dateval: datetime) -> str:
-    datestr = dateval.astimezone(tz=timezone.utc).isoformat(
-        sep='T',
-        timespec='milliseconds'
-    )
-    return f'{datestr[:-6]}Z'
+    # isoformat() runs in C; slicing off the '+00:00' offset beats any Python-level formatting
+    return dateval.astimezone(timezone.utc).isoformat(timespec='milliseconds')[:-6] + 'Z'
+
+
+_MISSING = object()
 
 
-default_encoders = {
+def _identity(obj: Any) -> Any:
+    return obj
+
+
+default_encoders: Dict[Any, Callable[[Any], Any]] = {
     datetime: datetime_encoder,
     date: str
 }
 
 
-SetIntStr = Set[Union[int, str]]
-DictIntStrAny = Dict[Union[int, str], Union[SetIntStr, Any]]
+_type_adapters: 'weakref.WeakKeyDictionary[type, Union[TypeAdapter, Exception]]' = weakref.WeakKeyDictionary()
+
 
+def _without_tracebacks(error: BaseException) -> BaseException:
+    # a cached error must not keep the frames (and payloads) it was raised under alive
+    pending: List[Optional[BaseException]] = [error]
+    seen = set()
+    while pending:
+        current = pending.pop()
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        current.__traceback__ = None
+        pending += [current.__cause__, current.__context__]
+    return error
 
-class Options(BaseModel):
+
+def _get_type_adapter(type_: type) -> Union[TypeAdapter, Exception]:
+    adapter = _type_adapters.get(type_)
+    if adapter is None:
+        try:
+            adapter = TypeAdapter(type_)
+        except Exception as e:
+            adapter = e
+            _without_tracebacks(adapter)
+        _type_adapters[type_] = adapter
+    return adapter
+
+
+_NESTED_SCHEMA_TYPES = {'model', 'dataclass', 'typed-dict', 'definitions', 'definition-ref'}
+_PLAIN_FIELD_KEYS = {'type', 'schema', 'validation_alias', 'serialization_alias', 'frozen', 'metadata'}
+_plain_models: 'weakref.WeakKeyDictionary[type, Optional[Dict[str, str]]]' = weakref.WeakKeyDictionary()
+
+
+def _is_plain_schema(schema: Any) -> bool:
+    if isinstance(schema, dict):
+        if 'serialization' in schema or schema.get('type') in _NESTED_SCHEMA_TYPES:
+            return False
+        return all(_is_plain_schema(value) for key, value in schema.items() if key not in ('default', 'metadata'))
+    if isinstance(schema, (list, tuple)):
+        return all(_is_plain_schema(item) for item in schema)
+    return True
+
+
+def _get_plain_model_fields(model: Type[BaseModel]) -> Optional[Dict[str, str]]:
+    """
+    Map field names to serialization aliases for models whose fields can be encoded
+    without model_dump: no model_dump override, custom serializers, computed or extra
+    fields, field settings beyond aliases, and no nested models or dataclasses.
+    Returns None for any other model.
+    """
+    if model in _plain_models:
+        return _plain_models[model]
+    fields: Optional[Dict[str, str]] = None
+    try:
+        schema = model.__pydantic_core_schema__
+        fields_schema = schema['schema']
+        if (
+            model.model_dump is BaseModel.model_dump
+            and schema['type'] == 'model'
+            and not schema.get('root_model')
+            and 'serialization' not in schema
+            and schema.get('config', {}).get('extra_fields_behavior') != 'allow'
+            and fields_schema['type'] == 'model-fields'
+            and not fields_schema.get('computed_fields')
+        ):
+            fields = {}
+            for name, field in fields_schema['fields'].items():
+                if not field.keys() <= _PLAIN_FIELD_KEYS or not _is_plain_schema(field['schema']):
+                    fields = None
+                    break
+                fields[name] = field.get('serialization_alias', name)
+    except Exception:
+        fields = None
+    _plain_models[model] = fields
+    return fields
+
+
+_LEAF_TYPES = {str, int, float, bool, type(None)}
+_LEAF_SCHEMA_TYPES = {'str', 'int', 'float', 'bool', 'none', 'literal'}
+_leaf_models: 'weakref.WeakKeyDictionary[type, bool]' = weakref.WeakKeyDictionary()
+
+
+def _is_leaf_schema(schema: Dict[str, Any]) -> bool:
+    while schema['type'] in ('default', 'nullable'):
+        schema = schema['schema']
+    return schema['type'] in _LEAF_SCHEMA_TYPES
+
+
+def _is_leaf_model(model: Type[BaseModel]) -> bool:
+    """
+    Whether every field of a model holds a scalar, so model_dump already returns encoded values.
+    """
+    if model in _leaf_models:
+        return _leaf_models[model]
+    leaf = False
+    try:
+        schema = model.__pydantic_core_schema__
+        fields_schema = schema['schema']
+        leaf = (
+            schema['type'] == 'model'
+            and not schema.get('root_model')
+            and 'serialization' not in schema
+            and schema.get('config', {}).get('extra_fields_behavior') != 'allow'
+            and fields_schema['type'] == 'model-fields'
+            and not fields_schema.get('computed_fields')
+            and all(
+                _is_leaf_schema(field['schema']) and not field.get('serialization_alias', '').startswith('_sa')
+                for field in fields_schema['fields'].values()
+            )
+        )
+    except Exception:
+        leaf = False
+    _leaf_models[model] = leaf
+    return leaf
+
+
+def _is_encoded_leaf_dict(obj_dict: Any, sqlalchemy_safe: bool) -> bool:
+    if type(obj_dict) is not dict:
+        return False
+    for key, value in obj_dict.items():
+        if type(value) not in _LEAF_TYPES or type(key) is not str:
+            return False
+        if sqlalchemy_safe and key.startswith('_sa'):
+            return False
+    return True
+
+
+SetIntStr = Union[Set[int], Set[str]]
+DictIntStrAny = Union[Dict[int, Any], Dict[str, Any]]
+
+
+@dataclasses.dataclass(frozen=True)
+class Options:
     include: Optional[Union[SetIntStr, DictIntStrAny]] = None
     exclude: Optional[Union[SetIntStr, DictIntStrAny]] = None
     by_alias: bool = True
@@ -39,71 +174,282 @@ class Options(BaseModel):
     sqlalchemy_safe: bool = True
     preserve_set: bool = False
 
+    def __post_init__(self) -> None:
+        for name in ('include', 'exclude'):
+            value = getattr(self, name)
+            if value is None or isinstance(value, (set, dict)):
+                continue
+            if not isinstance(value, (list, tuple, frozenset)):
+                raise TypeError(f'{name} must be a set, dict, list or tuple, not {type(value).__name__}')
+            object.__setattr__(self, name, set(value))
+        for name in _BOOL_OPTIONS:
+            if not isinstance(getattr(self, name), bool):
+                raise TypeError(f'{name} must be a bool, not {type(getattr(self, name)).__name__}')
+
+    @cached_property
+    def model_dump_kwargs(self) -> Dict[str, Any]:
+        return {
+            'include': self.include,
+            'exclude': self.exclude,
+            'by_alias': self.by_alias,
+            'exclude_unset': self.exclude_unset,
+            'exclude_none': self.exclude_none,
+            'exclude_defaults': self.exclude_defaults
+        }
+
+    @cached_property
+    def nested_options(self) -> 'Options':
+        if self.include is None and self.exclude is None:
+            return self
+        return dataclasses.replace(self, include=None, exclude=None)
+
+    @cached_property
+    def model_field_options(self) -> 'Options':
+        options = Options(
+            by_alias=self.by_alias,
+            exclude_none=self.exclude_none,
+            exclude_defaults=self.exclude_defaults,
+            sqlalchemy_safe=self.sqlalchemy_safe,
+            preserve_set=self.preserve_set
+        )
+        return self if options == self else options
 
-def encode(data: Any, **options) -> dict:
+
+_BOOL_OPTIONS = (
+    'by_alias',
+    'exclude_unset',
+    'exclude_none',
+    'exclude_defaults',
+    'sqlalchemy_safe',
+    'preserve_set'
+)
+_OPTION_NAMES = frozenset(field.name for field in dataclasses.fields(Options))
+_DEFAULT_OPTIONS = Options()
+
+
+def _known_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    # unknown keys are ignored, as they were when Options was a pydantic model
+    return {name: value for name, value in options.items() if name in _OPTION_NAMES}
+
+
+# the encoder and options an overridden handle_* method is currently called with
+_handler_options: 'ContextVar[Optional[Tuple[JsonAblr, Options]]]' = ContextVar('_handler_options', default=None)
+
+
+def encode(data: Any, **options: Any) -> Any:
+    if not options:
+        return _DEFAULT_ENCODER(data)
     encoder = JsonAblr(
         encoders=options.pop('encoders', {}),
-        **Options.model_validate(options).model_dump()
+        **options
     )
     return encoder(data)
 
 
-def encode_output(func=None, **options):
-    encoder = JsonAblr(
+def encode_output(func: Optional[Callable[..., Any]] = None, **options: Any) -> Any:
+    encoder = _DEFAULT_ENCODER if not options else JsonAblr(
         encoders=options.pop('encoders', {}),
-        **Options.model_validate(options).model_dump()
+        **options
     )
 
-    def decorator(func):
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
         @wraps(func)
-        def wrapper(*args, **kwargs):
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
             return encoder.encode(func(*args, **kwargs))
         return wrapper
 
     return decorator if func is None else decorator(func)
 
 
+class _Encoders(dict):
+    """
+    The encoders dict of a JsonAblr instance. Any change to it makes its owner rebuild the
+    tables derived from it.
+    """
+
+    _owner: Optional['weakref.ReferenceType[JsonAblr]'] = None
+
+    def _changed(self) -> None:
+        owner = self._owner() if self._owner is not None else None
+        if owner is not None:
+            owner._encoders_changed()
+
+    def __setitem__(self, key: Any, value: Callable[[Any], Any]) -> None:
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key: Any) -> None:
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, other: Any) -> '_Encoders':  # type: ignore[misc]
+        self.update(other)
+        return self
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def setdefault(self, key: Any, default: Any = None) -> Any:
+        value = super().setdefault(key, default)
+        self._changed()
+        return value
+
+    def pop(self, *args: Any) -> Any:
+        value = super().pop(*args)
+        self._changed()
+        return value
+
+    def popitem(self) -> Any:
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def clear(self) -> None:
+        super().clear()
+        self._changed()
+
+    def __reduce__(self) -> Any:
+        # copies and pickles are plain dicts, detached from the owner
+        return dict, (dict(self),)
+
+
 class JsonAblr:
 
-    def __init__(self, encoders: Optional[Dict[Any, Callable]] = None, **options) -> None:
-        self.encoders = {
-            **default_encoders,
-            **(encoders or {})
-        }
-        self._options = Options.model_validate(options)
-        self._override_options = None
+    _basemodel_types: 'weakref.WeakKeyDictionary[type, bool]' = weakref.WeakKeyDictionary()
+
+    def __init__(self, encoders: Optional[Dict[Any, Callable[[Any], Any]]] = None, **options: Any) -> None:
+        options = _known_options(options)
+        self._options = Options(**options) if options else _DEFAULT_OPTIONS
+        self._model_handler = self._bind_handler('handle_pydantic_model')
+        self._dataclass_handler = self._bind_handler('handle_dataclass')
+        self._dict_handler = self._bind_handler('handle_dict')
+        self._list_handler = self._bind_handler('handle_list_type')
+        self._set_handler = self._bind_handler('handle_set')
+        merged_encoders = _Encoders(default_encoders)
+        if encoders:
+            merged_encoders.update(encoders)
+        self._use_encoders(merged_encoders)
 
     @property
-    def options(self) -> Options:
-        return Options.model_validate({
-            **self._options.model_dump(),
-            **(self._override_options.model_dump() if self._override_options else {})
-        })
+    def encoders(self) -> Dict[Any, Callable[[Any], Any]]:
+        """
+        Encoders in use, keyed by type. Changing them, in place or by assignment, takes effect
+        on the next encode.
+        """
+        return self._encoders
+
+    @encoders.setter
+    def encoders(self, encoders: Dict[Any, Callable[[Any], Any]]) -> None:
+        self._use_encoders(_Encoders(encoders))
+
+    def _use_encoders(self, encoders: _Encoders) -> None:
+        encoders._owner = weakref.ref(self)
+        self._encoders = encoders
+        self._encoders_changed()
+
+    def _encoders_changed(self) -> None:
+        self._encoder_cache: 'weakref.WeakKeyDictionary[type, Optional[Callable[[Any], Any]]]' = (
+            weakref.WeakKeyDictionary()
+        )
+        self._fast_dispatch = self._build_dispatch()
+        self._handlers = self._build_handlers()
+        self._plain_dicts = getattr(self._handlers.get(dict), '__func__', None) is JsonAblr.handle_dict
+        self._plain_leaves = self._plain_dicts and all(
+            self._fast_dispatch.get(type_) is _identity for type_ in _LEAF_TYPES
+        )
+        self._container_types = self._build_container_types()
 
-    def __call__(self, obj: Any, **options) -> Any:
+    @property
+    def options(self) -> Options:
+        """
+        Options applied to the value being encoded, when read from an overridden handle_*
+        method, otherwise the options the encoder was created with.
+        """
+        handler_options = _handler_options.get()
+        if handler_options is not None and handler_options[0] is self:
+            return handler_options[1]
+        return self._options
+
+    def __call__(self, obj: Any, **options: Any) -> Any:
         return self.encode(obj, **options)
 
-    def encode(self, obj: Any, **options) -> Any:
-        if options:
-            self._override_options = Options.model_validate(options)
-        encoded = self._encode(obj)
-        self._override_options = None
-        return encoded
+    def encode(self, obj: Any, **options: Any) -> Any:
+        options = _known_options(options) if options else options
+        if not options:
+            return self._encode(obj, self.options)
+        return self._encode(obj, dataclasses.replace(self.options, **options))
+
+    def _bind_handler(self, name: str) -> Callable[[Any, Options], Any]:
+        handler = getattr(self, name)
+        if getattr(type(self), name) is getattr(JsonAblr, name):
+            return handler
+
+        # overrides keep the one-argument signature and read the options through self.options
+        def call_override(obj: Any, options: Options) -> Any:
+            token = _handler_options.set((self, options))
+            try:
+                return handler(obj)
+            finally:
+                _handler_options.reset(token)
+
+        return call_override
+
+    def _build_dispatch(self) -> Dict[type, Callable[[Any], Any]]:
+        dispatch: Dict[type, Callable[[Any], Any]] = {}
+        for type_ in (str, int, float, bool, type(None), dict, list, tuple):
+            custom_encoder = self._resolve_encoder(type_)
+            if custom_encoder:
+                dispatch[type_] = custom_encoder
+            elif type_ not in (dict, list, tuple):
+                dispatch[type_] = _identity
+        for type_, encoder in self.encoders.items():
+            if isinstance(type_, type):
+                dispatch[type_] = encoder
+        return dispatch
+
+    def _build_handlers(self) -> Dict[type, Callable[[Any, Options], Any]]:
+        handlers: Dict[type, Callable[[Any, Options], Any]] = {
+            dict: self._dict_handler,
+            list: self._list_handler,
+            tuple: self._list_handler
+        }
+        return {type_: handler for type_, handler in handlers.items() if type_ not in self._fast_dispatch}
+
+    def _build_container_types(self) -> Dict[type, bool]:
+        handlers = {
+            dict: JsonAblr.handle_dict,
+            list: JsonAblr.handle_list_type,
+            tuple: JsonAblr.handle_list_type
+        }
+        return {
+            type_: type_ is dict
+            for type_, handler in handlers.items()
+            if getattr(self._handlers.get(type_), '__func__', None) is handler
+        }
+
+    def _encode(self, obj: Any, options: Options) -> Any:
 
-    def _encode(self, obj: Any) -> Any:
+        handler = self._fast_dispatch.get(type(obj))
+        if handler is not None:
+            return handler(obj)
 
-        custom_encoder = self.get_encoder(self.encoders, obj)
+        options_handler = self._handlers.get(type(obj))
+        if options_handler is not None:
+            return options_handler(obj, options)
+
+        custom_encoder = self._resolve_encoder(type(obj))
         if custom_encoder:
             return custom_encoder(obj)
 
-        if isinstance(obj, BaseModel):
-            return self.handle_pydantic_model(obj)
+        if self._is_basemodel(type(obj)):
+            return self._model_handler(obj, options)
 
         if dataclasses.is_dataclass(obj):
-            return self.handle_dataclass(obj)
+            return self._dataclass_handler(obj, options)
 
         if isinstance(obj, dict):
-            return self.handle_dict(obj)
+            return self._dict_handler(obj, options)
 
         if isinstance(obj, Enum):
             return obj.value
@@ -114,28 +460,46 @@ class JsonAblr:
         if isinstance(obj, (str, int, float, type(None))):
             return obj
 
-        if self.options.preserve_set and isinstance(obj, (set, frozenset)):
-            return self.handle_set(obj)
+        if options.preserve_set and isinstance(obj, (set, frozenset)):
+            return self._set_handler(obj, options)
 
         if isinstance(obj, (list, set, frozenset, GeneratorType, tuple)):
-            return self.handle_list_type(obj)
+            return self._list_handler(obj, options)
 
-        try:
-            ObjModel = create_model('ObjModel', obj=(type(obj), ...))
-            return ObjModel(obj=obj).model_dump(mode='json')['obj']
-        except Exception as e:
-            errors: List[Exception] = []
-            errors.append(e)
+        errors: List[Exception] = []
+        adapter = _get_type_adapter(type(obj))
+        if isinstance(adapter, Exception):
+            errors.append(adapter)
+        else:
             try:
-                data = vars(obj)
+                return adapter.dump_python(obj, mode='json')
             except Exception as e:
                 errors.append(e)
-                raise ValueError(errors) from e
+        try:
+            data = vars(obj)
+        except Exception as e:
+            errors.append(e)
+            raise ValueError(errors) from e
 
         return data
 
+    @classmethod
+    def _is_basemodel(cls, type_: type) -> bool:
+        try:
+            return cls._basemodel_types[type_]
+        except KeyError:
+            is_basemodel = cls._basemodel_types[type_] = BaseModel in type_.__mro__
+            return is_basemodel
+
+    def _resolve_encoder(self, type_: type) -> Optional[Callable[[Any], Any]]:
+        try:
+            return self._encoder_cache[type_]
+        except KeyError:
+            custom_encoder = self._encoder_cache[type_] = self.get_type_encoder(self.encoders, type_)
+            return custom_encoder
+
     @staticmethod
-    def get_encoder(encoders: Dict[Any, Callable], obj: Any) -> Optional[Callable]:
+    def get_encoder(encoders: Dict[Any, Callable[[Any], Any]], obj: Any) -> Optional[Callable[[Any], Any]]:
         if not encoders:
             return None
         if type(obj) in encoders:
@@ -143,75 +507,163 @@ class JsonAblr:
         for type_, encoder in encoders.items():
             if isinstance(obj, type_):
                 return encoder
+        return None
 
-    def handle_pydantic_model(self, obj: BaseModel) -> dict:
-
-        obj_dict = obj.model_dump(**self.options.model_dump(include={
-            'include',
-            'exclude',
-            'by_alias',
-            'exclude_unset',
-            'exclude_none',
-            'exclude_defaults'
-        }))
-
-        encoder = self.__class__(
-            encoders=self.encoders,
-            **self.options.model_dump(include={
-                'exclude_none',
-                'exclude_defaults',
-                'sqlalchemy_safe',
-                'preserve_set'
-            })
-        )
-        return encoder.encode(obj_dict)
+    @staticmethod
+    def get_type_encoder(encoders: Dict[Any, Callable[[Any], Any]], type_: type) -> Optional[Callable[[Any], Any]]:
+        if not encoders:
+            return None
+        if type_ in encoders:
+            return encoders[type_]
+        for encoder_type, encoder in encoders.items():
+            if issubclass(type_, encoder_type):
+                return encoder
+        return None
 
-    def handle_dataclass(self, obj: Any) -> Any:
-        obj_dict = dataclasses.asdict(obj)
-        return self.encode(obj_dict)
+    def handle_pydantic_model(self, obj: BaseModel, options: Optional[Options] = None) -> Any:
+
+        options = self.options if options is None else options
+        leaf_model = self._plain_leaves and _is_leaf_model(type(obj))
+        if (
+            self._plain_dicts
+            and not leaf_model
+            and options.include is None
+            and options.exclude is None
+            and not options.exclude_unset
+            and not options.exclude_defaults
+        ):
+            fields = _get_plain_model_fields(type(obj))
+            if fields is not None:
+                return self._encode_model_fields(obj, fields, options)
+
+        obj_dict = obj.model_dump(**options.model_dump_kwargs)
+        if leaf_model and _is_encoded_leaf_dict(obj_dict, options.sqlalchemy_safe):
+            return obj_dict
+
+        return self._encode(obj_dict, options.model_field_options)
 
-    def handle_dict(self, obj: dict) -> dict:
+    def _encode_model_fields(self, obj: BaseModel, fields: Dict[str, str], options: Options) -> Dict[Any, Any]:
 
+        by_alias = options.by_alias
+        exclude_none = options.exclude_none
+        sqlalchemy_safe = options.sqlalchemy_safe
+
+        values = obj.__dict__
         encoded_dict = {}
-        allowed_keys = set(obj.keys())
-
-        if self.options.include is not None:
-            allowed_keys &= set(self.options.include)
-        if self.options.exclude is not None:
-            allowed_keys -= set(self.options.exclude)
-
-        encoder = self.__class__(
-            self.encoders,
-            **self.options.model_dump(
-                include={
-                    'by_alias',
-                    'exclude_unset',
-                    'exclude_none',
-                    'exclude_defaults',
-                    'sqlalchemy_safe',
-                    'preserve_set'
-                }
-            )
-        )
+        encode = self._encode
+        field_options = options.model_field_options
 
-        for key, value in obj.items():
-            if key not in allowed_keys:
+        for name, alias in fields.items():
+            value = values.get(name, _MISSING)
+            if value is _MISSING or (value is None and exclude_none):
                 continue
-            if value is None and self.options.exclude_none:
+            key = alias if by_alias else name
+            if sqlalchemy_safe and key.startswith('_sa'):
                 continue
-            if self.options.sqlalchemy_safe and isinstance(key, str) and key.startswith('_sa'):
-                continue
-            encoded_dict[encoder(key)] = encoder(value)
+            encoded_dict[encode(key, field_options)] = encode(value, field_options)
         return encoded_dict
 
-    def handle_list_type(self, obj: Union[list, set, frozenset, GeneratorType, tuple]):
-        encoded_list = []
-        for item in obj:
-            encoded_list.append(self(item))
-        return encoded_list
-
-    def handle_set(self, obj: Union[set, frozenset]):
-        encoded_set = set()
-        for item in obj:
-            encoded_set.add(self(item))
-        return encoded_set
+    def handle_dataclass(self, obj: Any, options: Optional[Options] = None) -> Any:
+        options = self.options if options is None else options
+        obj_dict = dataclasses.asdict(obj)
+        return self._encode(obj_dict, options)
+
+    def handle_dict(self, obj: Dict[Any, Any], options: Optional[Options] = None) -> Dict[Any, Any]:
+        return self._encode_tree(obj, self.options if options is None else options)
+
+    def handle_list_type(
+        self,
+        obj: Union[list, set, frozenset, GeneratorType, tuple],
+        options: Optional[Options] = None
+    ) -> List[Any]:
+        return self._encode_tree(obj, self.options if options is None else options)
+
+    def _encode_tree(self, root: Any, root_options: Options) -> Any:
+        """
+        Encode nested dicts, lists and tuples with an explicit stack instead of recursing per level.
+        """
+        containers = self._container_types
+        dispatch = self._fast_dispatch
+        encode = self._encode
+
+        if isinstance(root, dict):
+            items: Iterator[Any] = iter(root.items())
+            encoded_root: Any = {}
+        else:
+            items = iter(root)
+            encoded_root = []
+        stack: List[Tuple[Iterator[Any], Any, Options, int]] = [(items, encoded_root, root_options, id(root))]
+        active = {id(root)}
+
+        while stack:
+            items, encoded, options, obj_id = stack[-1]
+
+            if type(encoded) is dict:
+                include = options.include
+                exclude = options.exclude
+                exclude_none = options.exclude_none
+                sqlalchemy_safe = options.sqlalchemy_safe
+                child_options = options.nested_options
+
+                for key, value in items:
+                    if include is not None and key not in include:
+                        continue
+                    if exclude is not None and key in exclude:
+                        continue
+                    if value is None and exclude_none:
+                        continue
+                    if sqlalchemy_safe and (type(key) is str or isinstance(key, str)) and key.startswith('_sa'):
+                        continue
+                    is_dict = containers.get(type(value))
+                    if is_dict is None:
+                        encoded[encode(key, child_options)] = encode(value, child_options)
+                        continue
+                    child: Any = {} if is_dict else []
+                    encoded[encode(key, child_options)] = child
+                    child_id = id(value)
+                    if child_id in active:
+                        raise ValueError('Circular reference detected')
+                    active.add(child_id)
+                    stack.append((iter(value.items()) if is_dict else iter(value), child, child_options, child_id))
+                    break
+                else:
+                    stack.pop()
+                    active.discard(obj_id)
+            else:
+                item_type: Optional[type] = None
+                handler: Optional[Callable[[Any], Any]] = None
+
+                for value in items:
+                    if type(value) is not item_type:
+                        item_type = type(value)
+                        handler = dispatch.get(item_type)
+                        is_dict = containers.get(item_type) if handler is None else None
+                    if handler is _identity:
+                        encoded.append(value)
+                        continue
+                    if handler is not None:
+                        encoded.append(handler(value))
+                        continue
+                    if is_dict is None:
+                        encoded.append(encode(value, options))
+                        continue
+                    child = {} if is_dict else []
+                    encoded.append(child)
+                    child_id = id(value)
+                    if child_id in active:
+                        raise ValueError('Circular reference detected')
+                    active.add(child_id)
+                    stack.append((iter(value.items()) if is_dict else iter(value), child, options, child_id))
+                    break
+                else:
+                    stack.pop()
+                    active.discard(obj_id)
+        return encoded_root
+
+    def handle_set(self, obj: Union[set, frozenset], options: Optional[Options] = None) -> Set[Any]:
+        options = self.options if options is None else options
+        encode = self._encode
+        return {encode(item, options) for item in obj}
+
+
+_DEFAULT_ENCODER = JsonAblr()
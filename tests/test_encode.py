@@ -1,9 +1,19 @@
 """
 Test encode.
 """
-from jsonablr import encode, encode_output
+import gc
+import weakref
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from jsonablr import JsonAblr, encode, encode_output
+from jsonablr.main import default_encoders
 from datetime import datetime, timezone
-from pydantic import BaseModel, AwareDatetime, RootModel
+from decimal import Decimal
+from uuid import UUID
+from typing import Optional
+from pydantic import (
+    BaseModel, AwareDatetime, ConfigDict, Field, RootModel, create_model, field_serializer, model_serializer
+)
 
 
 def test_custom_encoder():
@@ -91,3 +101,269 @@ def test_datetime_types():
     dt = AwareDatetimeT.model_validate('2020-01-01T12:30:00.000Z')
 
     assert encode(dt) == '2020-01-01T12:30:00.000Z'
+
+
+def test_encode_options_override():
+
+    encoder = JsonAblr(preserve_set=True)
+
+    assert encoder.encode({'a': {1, 2}, 'b': None}, exclude_none=True) == {'a': {1, 2}}
+    assert encoder.encode({'a': {1, 2}, 'b': None}) == {'a': {1, 2}, 'b': None}
+
+
+def test_include_exclude():
+
+    data = {'a': 1, 'b': 2, 'c': 3}
+
+    assert encode(data, include=['a', 'b']) == {'a': 1, 'b': 2}
+    assert encode(data, exclude=['a']) == {'b': 2, 'c': 3}
+    assert encode(data, include={'a', 'b'}, exclude={'b'}) == {'a': 1}
+    assert encode({'a': data, 'b': 2}, include={'a'}) == {'a': data}
+
+
+def test_unknown_options_ignored():
+
+    assert encode({'a': 1}, foo=1) == {'a': 1}
+    assert JsonAblr(foo=1).encode({'a': None}, exclude_none=True, encoders={str: str}) == {}
+
+
+def test_invalid_options():
+
+    with pytest.raises(TypeError):
+        encode({'name': 1}, include='name')
+    with pytest.raises(TypeError):
+        encode({'a': 1}, exclude=1)
+    with pytest.raises(TypeError):
+        JsonAblr(exclude_none='yes')
+    with pytest.raises(TypeError):
+        JsonAblr().encode({'a': 1}, by_alias=1)
+
+    assert encode({'a': 1, 'b': 2}, exclude=frozenset({'b'})) == {'a': 1}
+
+
+def test_custom_encoder_subclass():
+
+    def int_encoder(obj):
+        return 'int'
+
+    assert encode([1, True, 'a'], encoders={int: int_encoder}) == ['int', 'int', 'a']
+
+
+def test_encoders_changed():
+
+    encoder = JsonAblr()
+    assert encoder.encode(['a']) == ['a']
+
+    encoder.encoders[str] = str.upper
+    assert encoder.encode(['a', {'b': 'c'}]) == ['A', {'B': 'C'}]
+    assert JsonAblr().encode(['a']) == ['a']
+
+    del encoder.encoders[str]
+    assert encoder.encode(['a']) == ['a']
+
+    encoder.encoders = {**encoder.encoders, str: str.upper}
+    assert encoder.encode(['a']) == ['A']
+
+
+def test_encoder_shared_between_threads():
+
+    encoder = JsonAblr(exclude={'password'})
+    data = {'user': 'a', 'password': 'secret', 'nested': [{'password': 'kept'}]}
+    expected = {'user': 'a', 'nested': [{'password': 'kept'}]}
+
+    def run():
+        return [encoder.encode(data) for _ in range(500)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = [result for future in [executor.submit(run) for _ in range(8)] for result in future.result()]
+
+    assert all(result == expected for result in results)
+    assert encoder.encode(data) == expected
+
+
+def test_encoder_reentrant():
+
+    class Wrapper:
+        pass
+
+    encoder = JsonAblr(
+        encoders={Wrapper: lambda obj: encoder.encode({'user': 'a', 'password': 'secret'})},
+        exclude={'password'}
+    )
+
+    data = {'inner': {'wrapped': Wrapper()}, 'password': 'secret'}
+
+    assert encoder.encode(data) == {'inner': {'wrapped': {'user': 'a'}}}
+    assert encoder.encode({'password': 'secret'}) == {}
+
+
+def test_handler_override():
+
+    class KeyUpper(JsonAblr):
+
+        def handle_dict(self, obj):
+            return {key.upper(): value for key, value in super().handle_dict(obj).items()}
+
+        def handle_pydantic_model(self, obj):
+            return {'model': super().handle_pydantic_model(obj)}
+
+    class Item(BaseModel):
+        name: str
+        size: Optional[int] = None
+
+    encoder = KeyUpper(exclude={'b'})
+
+    assert encoder.encode({'a': {'b': 1}, 'b': 2}) == {'A': {'B': 1}}
+    assert encoder.encode({'a': Item(name='x')}, exclude_none=True) == {'A': {'model': {'NAME': 'x'}}}
+    assert encoder.options.exclude == {'b'}
+
+
+def test_fallback_types():
+
+    class Plain:
+        def __init__(self):
+            self.a = 1
+
+    uuid = UUID('12345678-1234-5678-1234-567812345678')
+
+    assert encode([uuid, uuid, Decimal('1.50')]) == [str(uuid), str(uuid), '1.50']
+    assert encode([Plain(), Plain()]) == [{'a': 1}, {'a': 1}]
+
+
+def test_fallback_does_not_retain_payload():
+
+    class Plain:
+        def __init__(self):
+            self.a = 1
+
+    item = Plain()
+    ref = weakref.ref(item)
+
+    assert encode({'item': item}) == {'item': {'a': 1}}
+    del item
+    gc.collect()
+
+    assert ref() is None
+
+
+def test_pydantic_model_fields():
+
+    class TestModel(BaseModel):
+        a: int
+        b: Optional[str] = Field(None, alias='bee')
+        when: datetime
+
+    class SerializedModel(TestModel):
+
+        @field_serializer('a')
+        def serialize_a(self, value):
+            return value * 10
+
+    class ExcludeIfModel(TestModel):
+        a: int = Field(exclude_if=lambda value: value == 0)
+
+    class DumpedModel(TestModel):
+
+        def model_dump(self, **kwargs):
+            return {'dumped': super().model_dump(**kwargs)['a']}
+
+    when = datetime(2020, 1, 1, 13, 30, 0).replace(tzinfo=timezone.utc)
+    item = TestModel(a=1, when=when)
+
+    assert encode(item) == {'a': 1, 'bee': None, 'when': '2020-01-01T13:30:00.000Z'}
+    assert encode(item, by_alias=False, exclude_none=True) == {'a': 1, 'when': '2020-01-01T13:30:00.000Z'}
+    assert encode(SerializedModel(a=1, when=when), exclude_none=True) == {'a': 10, 'when': '2020-01-01T13:30:00.000Z'}
+    assert encode(ExcludeIfModel(a=0, when=when), exclude_none=True) == {'when': '2020-01-01T13:30:00.000Z'}
+    assert encode(DumpedModel(a=1, when=when)) == {'dumped': 1}
+    assert encode(item, encoders={dict: lambda obj: 'dict'}) == 'dict'
+
+
+def test_pydantic_leaf_model():
+
+    class TestModel(BaseModel):
+        a: int
+        b: Optional[str] = None
+        c: bool = True
+
+    assert encode(TestModel(a=1), exclude={'c'}) == {'a': 1, 'b': None}
+    assert encode(TestModel(a=1), exclude_defaults=True, encoders={int: str}) == {'a': '1'}
+    assert encode(TestModel(a=1), encoders={dict: lambda obj: 'dict'}) == 'dict'
+
+
+def test_pydantic_leaf_model_serialization():
+
+    class StrModel(BaseModel):
+        a: int
+
+        @model_serializer
+        def serialize(self):
+            return 'custom'
+
+    class SaModel(BaseModel):
+        a: int
+
+        @model_serializer
+        def serialize(self):
+            return {'a': self.a, '_sa_state': 'x'}
+
+    class ExtraModel(BaseModel):
+        model_config = ConfigDict(extra='allow')
+        a: int
+
+    assert encode(StrModel(a=1)) == 'custom'
+    assert encode(SaModel(a=1)) == {'a': 1}
+    assert encode(ExtraModel(a=1, _sa_instance_state='x')) == {'a': 1}
+    assert encode(ExtraModel(a=1, b='y'), exclude={'b'}) == {'a': 1}
+
+
+def test_encoders_not_shared():
+
+    encoder = JsonAblr()
+    encoder.encoders[str] = str.upper
+
+    assert encoder.encode(['a']) == ['A']
+    assert str not in default_encoders
+    assert JsonAblr().encode(['b']) == ['b']
+    assert encode(['b']) == ['b']
+    assert JsonAblr(encoders={int: str}).encoders == {**default_encoders, int: str}
+
+
+def test_deeply_nested():
+
+    data = root = []
+    for _ in range(10000):
+        child = {'a': [], 'b': None}
+        data.append(child)
+        data = child['a']
+
+    encoded = encode(root, exclude_none=True)
+    for _ in range(10000):
+        assert list(encoded[0]) == ['a']
+        encoded = encoded[0]['a']
+    assert encoded == []
+
+
+def test_circular_reference():
+
+    data = {'a': []}
+    data['a'].append(data)
+
+    with pytest.raises(ValueError):
+        encode(data)
+
+
+def test_dynamic_models_not_retained():
+
+    def encode_dynamic_models():
+        Dynamic = create_model('Dynamic', a=(int, ...), b=(list, []))
+        Leaf = create_model('Leaf', a=(int, ...))
+
+        assert encode([Dynamic(a=1)]) == [{'a': 1, 'b': []}]
+        assert encode(Dynamic(a=1), exclude={'a'}) == {'b': []}
+        assert encode({'leaf': Leaf(a=1)}) == {'leaf': {'a': 1}}
+        return weakref.ref(Dynamic), weakref.ref(Leaf)
+
+    refs = encode_dynamic_models()
+    gc.collect()
+
+    assert [ref() for ref in refs] == [None, None]